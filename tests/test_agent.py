@@ -1,18 +1,20 @@
 import json
-import time
 import threading
+from collections import defaultdict, deque
 from pathlib import Path
 
 import pytest
 import requests
 
 from worker_agent.agent import WorkerAgent
+from worker_agent.executors.docker_executor import _LOG_FLUSH_BYTES, _LOG_FLUSH_INTERVAL_SECONDS
 
 
 class DummyResponse:
-    def __init__(self, status_code, data=None):
+    def __init__(self, status_code, data=None, headers=None):
         self.status_code = status_code
         self._data = data
+        self.headers = headers or {}
 
     def json(self):
         if self._data is None:
@@ -26,32 +28,34 @@ class DummyResponse:
 
 class DummySession:
     def __init__(self):
-        self.calls = []
-        self.next_job_responses = []
-        self.status_responses = []
-        self.heartbeat_responses = []
-        self.job_status_post_responses = []
+        self.calls_by_endpoint = defaultdict(list)
+        self.next_job_responses = deque()
+        self.status_responses = deque()
+        self.heartbeat_responses = deque()
+        self.job_status_post_responses = deque()
+        # endpoint -> (scripted responses, default status code)
+        self._post_responses = {
+            "heartbeat": (self.heartbeat_responses, 200),
+            "job-status": (self.job_status_post_responses, 200),
+            "next-job": (self.next_job_responses, 204),
+        }
+        # Set on every POST to the endpoint so threaded tests can block on it.
+        self.posted = {endpoint: threading.Event() for endpoint in self._post_responses}
 
     def post(self, url, json=None, timeout=None):  # noqa: A003 json parameter name is intentional
-        self.calls.append({"url": url, "json": json})
-        if url.endswith("/heartbeat"):
-            if self.heartbeat_responses:
-                return self.heartbeat_responses.pop(0)
-            return DummyResponse(200, {})
-        if url.endswith("/job-status"):
-            if self.job_status_post_responses:
-                return self.job_status_post_responses.pop(0)
-            return DummyResponse(200, {})
-        if url.endswith("/next-job"):
-            if self.next_job_responses:
-                return self.next_job_responses.pop(0)
-            return DummyResponse(204, {})
-        return DummyResponse(200, {})
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls_by_endpoint[endpoint].append({"url": url, "json": json})
+        if endpoint in self.posted:
+            self.posted[endpoint].set()
+        scripted, default_status = self._post_responses.get(endpoint, ((), 200))
+        if scripted:
+            return scripted.popleft()
+        return DummyResponse(default_status, {})
 
     def get(self, url, timeout=None):
-        self.calls.append({"url": url, "json": None})
+        self.calls_by_endpoint["status"].append({"url": url, "json": None})
         if self.status_responses:
-            status = self.status_responses.pop(0)
+            status = self.status_responses.popleft()
             return DummyResponse(200, {"status": status})
         return DummyResponse(200, {"status": "running"})
 
@@ -61,13 +65,12 @@ class DummyContainer:
         self.id = "cid-123"
         self.name = "container-name"
         self._exit_code = exit_code
-        self._logs = logs or [b"line1\n"]
+        self._logs = b"".join(logs or [b"line1\n"])
         self.removed = False
         self.stop_called = False
 
     def logs(self, stream=True, follow=True):
-        for chunk in self._logs:
-            yield chunk
+        yield self._logs
 
     def wait(self):
         return {"StatusCode": self._exit_code}
@@ -79,6 +82,37 @@ class DummyContainer:
         self.stop_called = True
 
 
+class ChunkedLogContainer(DummyContainer):
+    """Container that streams each chunk separately and calls ``after_chunk`` once it is consumed."""
+
+    def __init__(self, chunks, after_chunk):
+        super().__init__(exit_code=0)
+        self._chunks = chunks
+        self._after_chunk = after_chunk
+
+    def logs(self, stream=True, follow=True):
+        for index, chunk in enumerate(self._chunks):
+            yield chunk
+            self._after_chunk(index)
+
+
+class StoppableContainer(DummyContainer):
+    """Container whose ``wait`` blocks until ``stop`` is called by the monitor."""
+
+    def __init__(self):
+        super().__init__(exit_code=137, logs=[b"start\n"])
+        self._stop_evt = threading.Event()
+
+    def wait(self):
+        if self._stop_evt.wait(timeout=2):
+            return {"StatusCode": 137}
+        return {"StatusCode": 0}
+
+    def stop(self):
+        super().stop()
+        self._stop_evt.set()
+
+
 class DummyDockerClient:
     def __init__(self, container):
         self.container = container
@@ -107,6 +141,19 @@ class PullTrackingDockerClient(DummyDockerClient):
         self.images = PullTrackingImages()
 
 
+class NoGpuDockerClient(DummyDockerClient):
+    def __init__(self, container, error):
+        super().__init__(container)
+        self.error = error
+        self.run_calls = []
+
+    def run(self, **kwargs):
+        self.run_calls.append(kwargs)
+        if kwargs.get("device_requests"):
+            raise self.error
+        return super().run(**kwargs)
+
+
 class LabeledContainer:
     def __init__(self, job_id: str, worker_id: str, status: str):
         self.id = f"cid-{job_id}"
@@ -133,33 +180,62 @@ class CleanupAwareDockerClient(PullTrackingDockerClient):
         return list(self._existing)
 
 
-def test_run_job_success(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
+@pytest.fixture(scope="module")
+def noop_docker():
+    """Docker client factory for tests that never start a container."""
+    client = DummyDockerClient(DummyContainer())
+    return lambda: client
+
+
+@pytest.fixture
+def make_agent(tmp_path):
+    """Build a docker-mode ``WorkerAgent`` wired to dummy backend/docker doubles."""
+
+    def _make(container=None, docker_client=None, session=None, **overrides):
+        session = session if session is not None else DummySession()
+        if docker_client is None and "docker_client_factory" not in overrides:
+            docker_client = DummyDockerClient(container if container is not None else DummyContainer())
+        kwargs = {
+            "server_url": "http://server",
+            "worker_id": "worker-a",
+            "shared_dir": str(tmp_path),
+            "image": "my-image",
+            "session": session,
+            "docker_client_factory": lambda: docker_client,
+            "heartbeat_interval": 0,
+            "status_poll_interval": 0.0,
+        }
+        kwargs.update(overrides)
+        return WorkerAgent(**kwargs), session, docker_client
+
+    return _make
+
+
+@pytest.fixture
+def watched_job(make_agent, noop_docker):
+    """Register one job with the docker status watcher on a fake clock; the test drives polls itself."""
+    agent, _, _ = make_agent(docker_client_factory=noop_docker, status_poll_interval=10)
+    executor = agent._executor
+    clock = {"now": 100.0}
+    executor._clock = lambda: clock["now"]
+    executor._watcher_stop.set()  # keep the background watcher from polling concurrently
+    entry = executor._watch_job("job-1", DummyContainer(), "cid", "cname")
+    yield agent, executor, entry, clock
+    executor._unwatch_job("job-1")
+
+
+def test_run_job_success(make_agent, fs):
     container = DummyContainer(exit_code=0, logs=[b"hello\n"])
-    docker_client = DummyDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        poll_interval=0.1,
-        heartbeat_interval=0.1,
-        status_poll_interval=0.0,
-    )
+    agent, session, docker_client = make_agent(container=container, shared_dir="/shared")
 
     job = {"job_id": "job1", "config_path": "configs/demo.yaml", "job_name": "Demo"}
     agent._run_job(job)
 
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = session.calls_by_endpoint["job-status"]
     assert status_calls[0]["json"]["status"] == "running"
     assert status_calls[-1]["json"]["status"] == "finished"
 
-    log_path = shared_dir / "jobs" / "job1" / "logs" / "job1.log"
+    log_path = Path(agent.shared_dir) / "jobs" / "job1" / "logs" / "job1.log"
     assert log_path.exists()
     assert "hello" in log_path.read_text()
 
@@ -169,25 +245,71 @@ def test_run_job_success(tmp_path):
     assert docker_client.last_kwargs["labels"]["opeva.worker_id"] == "worker-a"
 
 
-def test_run_job_pulls_image_before_start(tmp_path, monkeypatch):
+def test_run_job_appends_container_log_bytes_verbatim(make_agent):
+    chunks = [b"caf\xc3\xa9 \xff\n", bytearray(b"raw\n"), "text \u00e9\n"]
+    container = ChunkedLogContainer(chunks, after_chunk=lambda index: None)
+    agent, _, _ = make_agent(container=container)
+
+    agent._run_job({"job_id": "job-bytes", "config_path": "cfg.yaml"})
+
+    log_path = Path(agent.shared_dir) / "jobs" / "job-bytes" / "logs" / "job-bytes.log"
+    assert log_path.read_bytes() == b"caf\xc3\xa9 \xff\nraw\ntext \xc3\xa9\n"
+
+
+def test_run_job_flushes_logs_by_size_and_while_stream_is_idle(make_agent, tmp_path):
+    clock = {"now": 0.0}
+    log_path = tmp_path / "jobs" / "job-flush" / "logs" / "job-flush.log"
+    big_chunk = b"x" * _LOG_FLUSH_BYTES
+    on_disk = []
+
+    def after_chunk(index):
+        on_disk.append(log_path.read_bytes())
+        if index == 0:
+            # The stream goes quiet: only the flusher tick can publish the line.
+            clock["now"] += _LOG_FLUSH_INTERVAL_SECONDS / 2
+            agent._executor._flush_stale_logs()
+            on_disk.append(log_path.read_bytes())
+            clock["now"] += _LOG_FLUSH_INTERVAL_SECONDS
+            agent._executor._flush_stale_logs()
+            on_disk.append(log_path.read_bytes())
+
+    container = ChunkedLogContainer([b"first\n", big_chunk], after_chunk)
+    agent, _, _ = make_agent(container=container)
+    agent._executor._clock = lambda: clock["now"]
+
+    agent._run_job({"job_id": "job-flush", "config_path": "cfg.yaml"})
+
+    assert on_disk == [b"", b"", b"first\n", b"first\n" + big_chunk]
+    assert agent._executor._open_logs == {}
+
+
+def test_container_name_is_restricted_to_docker_charset(make_agent, noop_docker):
+    agent, _, _ = make_agent(worker_id="worker a", docker_client_factory=noop_docker)
+
+    name = agent._build_container_name("0123456789abcdef", "Simulação #1/v2")
+
+    assert name == "job_worker_a_Simula__o__1_v2_01234567"
+
+
+def test_prepare_log_file_creates_layout_once(make_agent, noop_docker, monkeypatch):
+    agent, _, _ = make_agent(docker_client_factory=noop_docker)
+    chmods = []
+    monkeypatch.setattr(agent, "_chmod_best_effort", lambda path, mode: chmods.append(path))
+
+    log_path = agent._prepare_log_file("job-log")
+    assert log_path == Path(agent.shared_dir) / "jobs" / "job-log" / "logs" / "job-log.log"
+    assert log_path.is_file()
+    assert len(chmods) == 4
+
+    assert agent._prepare_log_file("job-log") == log_path
+    agent._prepare_log_file("job-other")
+    assert len(chmods) == 7
+
+
+def test_run_job_pulls_image_before_start(make_agent, monkeypatch):
     monkeypatch.setenv("WORKER_DOCKER_PULL_POLICY", "always")
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
     container = DummyContainer(exit_code=0, logs=[b"hello\n"])
-    docker_client = PullTrackingDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        poll_interval=0.1,
-        heartbeat_interval=0.1,
-        status_poll_interval=0.0,
-    )
+    agent, _, docker_client = make_agent(docker_client=PullTrackingDockerClient(container))
 
     job = {"job_id": "job-pull", "config_path": "configs/demo.yaml", "job_name": "Demo", "image": "calof/algorithms:v1"}
     agent._run_job(job)
@@ -195,385 +317,421 @@ def test_run_job_pulls_image_before_start(tmp_path, monkeypatch):
     assert docker_client.images.pulled == ["calof/algorithms:v1"]
 
 
-def test_orphan_cleanup_removes_exited_job_container(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
+def test_orphan_cleanup_removes_exited_job_container(make_agent):
     active_container = DummyContainer(exit_code=0, logs=[b"ok\n"])
     orphan = LabeledContainer(job_id="old-job", worker_id="worker-a", status="exited")
-    docker_client = CleanupAwareDockerClient(active_container, [orphan])
+    agent, _, _ = make_agent(docker_client=CleanupAwareDockerClient(active_container, [orphan]))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.0,
-    )
     agent._run_job({"job_id": "job-clean", "config_path": "cfg.yaml", "job_name": "Demo"})
     assert orphan.removed is True
 
 
-def test_orphan_cleanup_keeps_running_container_when_backend_running(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
+def test_orphan_cleanup_keeps_running_container_when_backend_running(make_agent):
     session = DummySession()
     session.status_responses.append("running")  # for existing orphan-labeled running container
     active_container = DummyContainer(exit_code=0, logs=[b"ok\n"])
     running = LabeledContainer(job_id="running-job", worker_id="worker-a", status="running")
-    docker_client = CleanupAwareDockerClient(active_container, [running])
+    agent, _, _ = make_agent(session=session, docker_client=CleanupAwareDockerClient(active_container, [running]))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.0,
-    )
     agent._run_job({"job_id": "job-keep", "config_path": "cfg.yaml", "job_name": "Demo"})
     assert running.removed is False
     assert running.stop_called is False
 
 
-def test_orphan_cleanup_removes_running_container_when_backend_terminal(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
+def test_orphan_cleanup_removes_running_container_when_backend_terminal(make_agent):
     session = DummySession()
     session.status_responses.append("failed")  # for existing running orphan container
     active_container = DummyContainer(exit_code=0, logs=[b"ok\n"])
     running = LabeledContainer(job_id="failed-job", worker_id="worker-a", status="running")
-    docker_client = CleanupAwareDockerClient(active_container, [running])
+    agent, _, _ = make_agent(session=session, docker_client=CleanupAwareDockerClient(active_container, [running]))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.0,
-    )
     agent._run_job({"job_id": "job-clean-running", "config_path": "cfg.yaml", "job_name": "Demo"})
     assert running.stop_called is True
     assert running.removed is True
 
 
-def test_run_job_failure(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
-    container = DummyContainer(exit_code=5, logs=[b"oops\n"])
-    docker_client = DummyDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.0,
-    )
+def test_run_job_failure(make_agent, fs):
+    agent, session, _ = make_agent(container=DummyContainer(exit_code=5, logs=[b"oops\n"]), shared_dir="/shared")
 
     agent._run_job({"job_id": "job2", "config_path": "cfg.yaml", "job_name": "Demo"})
 
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = session.calls_by_endpoint["job-status"]
     assert status_calls[-1]["json"]["status"] == "failed"
 
 
-def test_poll_once_dispatches_job(monkeypatch):
-    session = DummySession()
+def test_poll_once_dispatches_job(make_agent):
+    agent, session, _ = make_agent(image="img")
     job_payload = {"job_id": "job9", "config_path": "cfg.yaml", "job_name": "Demo"}
     session.next_job_responses.append(DummyResponse(200, job_payload))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
-    )
-
     handled = agent.poll_once()
     assert handled is True
 
 
-def test_exit_after_job_stops_worker(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
+def test_next_job_long_poll_sends_wait_hint(make_agent, noop_docker):
+    agent, session, _ = make_agent(docker_client_factory=noop_docker)
+    agent._request_next_job()
+    assert session.calls_by_endpoint["next-job"][-1]["json"] == {"worker_id": "worker-a"}
+
+    agent, session, _ = make_agent(docker_client_factory=noop_docker, next_job_wait=25)
+    agent._request_next_job()
+    assert session.calls_by_endpoint["next-job"][-1]["json"] == {"worker_id": "worker-a", "wait": 25}
+
+
+def test_held_next_job_long_poll_does_not_block_other_backend_calls(make_agent, noop_docker):
+    class HeldNextJobSession(DummySession):
+        def __init__(self):
+            super().__init__()
+            self.release = threading.Event()
+
+        def post(self, url, json=None, timeout=None):  # noqa: A003
+            response = super().post(url, json=json, timeout=timeout)
+            if url.endswith("/next-job"):
+                self.release.wait(timeout=5)
+            return response
+
+    session = HeldNextJobSession()
+    agent, _, _ = make_agent(session=session, docker_client_factory=noop_docker, heartbeat_interval=30, next_job_wait=25)
+    poller = threading.Thread(target=agent._request_next_job, daemon=True)
+    poller.start()
+    try:
+        assert session.posted["next-job"].wait(timeout=1)
+
+        agent._start_heartbeat_loop()
+        assert session.posted["heartbeat"].wait(timeout=1), "heartbeat must not queue behind the long-poll"
+        assert agent._fetch_status("job-held") == "running"
+        assert poller.is_alive(), "next-job should still be held by the backend"
+    finally:
+        session.release.set()
+        agent.stop()
+        poller.join(timeout=1)
+        agent._heartbeat_thread.join(timeout=1)
+    assert not poller.is_alive()
+
+
+def test_exit_after_job_stops_worker(make_agent, fs):
+    agent, session, _ = make_agent(image="img", exit_after_job=True, shared_dir="/shared")
     job_payload = {"job_id": "job-exit", "config_path": "cfg.yaml", "job_name": "Demo"}
     session.next_job_responses.append(DummyResponse(200, job_payload))
-    container = DummyContainer(exit_code=0)
-    docker_client = DummyDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="img",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        exit_after_job=True,
-        status_poll_interval=0.0,
-        heartbeat_interval=0,
-    )
 
     handled = agent.poll_once()
     assert handled is True
     assert agent._stop_event.is_set() is True
 
 
-def test_request_exit_after_current_job_when_idle(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
-    container = DummyContainer(exit_code=0)
-    docker_client = DummyDockerClient(container)
+def test_exit_after_job_still_sends_post_job_heartbeat_from_loop(make_agent):
+    agent, session, _ = make_agent(exit_after_job=True, heartbeat_interval=30)
+    session.next_job_responses.append(DummyResponse(200, {"job_id": "job-hb", "config_path": "cfg.yaml"}))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="img",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.0,
-        heartbeat_interval=0,
-    )
+    agent.run_forever()
+
+    assert not agent._heartbeat_thread.is_alive()
+    heartbeats = session.calls_by_endpoint["heartbeat"]
+    assert heartbeats[-1]["json"]["info"]["last_terminal_status"] == "finished"
+    assert heartbeats[-1]["json"]["info"]["last_job_id"] == "job-hb"
+
+
+def test_request_exit_after_current_job_when_idle(make_agent, noop_docker, fs):
+    agent, _, _ = make_agent(image="img", shared_dir="/shared", docker_client_factory=noop_docker)
 
     agent.request_exit_after_current_job()
     assert agent._stop_event.is_set() is True
 
 
-def test_poll_once_no_job(monkeypatch):
-    session = DummySession()
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
-    )
+def test_poll_once_no_job(make_agent, noop_docker):
+    agent, session, _ = make_agent(image="img", docker_client_factory=noop_docker)
 
     handled = agent.poll_once()
     assert handled is False
     # heartbeat was sent
-    assert any(call for call in session.calls if call["url"].endswith("/heartbeat"))
+    assert session.calls_by_endpoint["heartbeat"]
 
 
-def test_run_job_canceled(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-    session = DummySession()
-    session.status_responses = ["running", "canceled"]
+def test_stop_interrupts_poll_interval_sleep(make_agent, noop_docker):
+    agent, session, _ = make_agent(docker_client_factory=noop_docker, poll_interval=30)
 
-    class CancelContainer(DummyContainer):
-        def __init__(self):
-            super().__init__(exit_code=137, logs=[b"start\n"])
+    thread = threading.Thread(target=agent.run_forever, daemon=True)
+    thread.start()
+    assert session.posted["next-job"].wait(timeout=1)
+    agent.stop()
+    thread.join(timeout=1)
 
-        def wait(self):
-            for _ in range(20):
-                if self.stop_called:
-                    return {"StatusCode": 137}
-                time.sleep(0.01)
-            return {"StatusCode": 0}
+    assert not thread.is_alive()
+    assert len(session.calls_by_endpoint["next-job"]) == 1
 
-    container = CancelContainer()
-    docker_client = DummyDockerClient(container)
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.05,
-        heartbeat_interval=0.0,
-    )
+def test_run_job_canceled(make_agent):
+    session = DummySession()
+    session.status_responses.extend(["running", "canceled"])
+    container = StoppableContainer()
+    agent, _, _ = make_agent(session=session, container=container, status_poll_interval=0.001)
 
     agent._run_job({"job_id": "job3", "config_path": "cfg.yaml", "job_name": "Demo"})
 
     assert container.stop_called is True
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    assert agent._executor._watched_jobs == {}
+    status_calls = session.calls_by_endpoint["job-status"]
     assert status_calls[-1]["json"]["status"] == "canceled"
 
 
-def test_run_job_stop_requested(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
+def test_run_job_stop_requested(make_agent):
     session = DummySession()
-    session.status_responses = ["running", "stop_requested"]
-
-    class StopContainer(DummyContainer):
-        def __init__(self):
-            super().__init__(exit_code=137, logs=[b"start\n"])
-
-        def wait(self):
-            for _ in range(20):
-                if self.stop_called:
-                    return {"StatusCode": 137}
-                time.sleep(0.01)
-            return {"StatusCode": 0}
-
-    container = StopContainer()
-    docker_client = DummyDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.05,
-        heartbeat_interval=0.0,
-    )
+    session.status_responses.extend(["running", "stop_requested"])
+    container = StoppableContainer()
+    agent, _, _ = make_agent(session=session, container=container, status_poll_interval=0.001)
 
     agent._run_job({"job_id": "job-stop", "config_path": "cfg.yaml", "job_name": "Demo"})
 
     assert container.stop_called is True
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = session.calls_by_endpoint["job-status"]
     assert status_calls[-1]["json"]["status"] == "stopped"
 
 
-def test_run_job_stops_when_backend_requeued(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
+def test_run_job_stops_when_backend_requeued(make_agent):
     session = DummySession()
-    session.status_responses = ["running", "queued"]
-
-    class RequeueContainer(DummyContainer):
-        def __init__(self):
-            super().__init__(exit_code=137, logs=[b"start\n"])
-
-        def wait(self):
-            for _ in range(20):
-                if self.stop_called:
-                    return {"StatusCode": 137}
-                time.sleep(0.01)
-            return {"StatusCode": 0}
-
-    container = RequeueContainer()
-    docker_client = DummyDockerClient(container)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.05,
-        heartbeat_interval=0.0,
-    )
+    session.status_responses.extend(["running", "queued"])
+    container = StoppableContainer()
+    agent, _, _ = make_agent(session=session, container=container, status_poll_interval=0.001)
 
     agent._run_job({"job_id": "job-requeue", "config_path": "cfg.yaml", "job_name": "Demo"})
 
     assert container.stop_called is True
-    status_calls = [call["json"]["status"] for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = [call["json"]["status"] for call in session.calls_by_endpoint["job-status"]]
     assert status_calls
     assert all(status == "running" for status in status_calls)
 
 
-def test_run_job_stops_when_backend_failed(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
+def test_run_job_stops_when_backend_failed(make_agent):
     session = DummySession()
-    session.status_responses = ["running", "failed"]
+    session.status_responses.extend(["running", "failed"])
+    container = StoppableContainer()
+    agent, _, _ = make_agent(session=session, container=container, status_poll_interval=0.001)
 
-    class FailedContainer(DummyContainer):
-        def __init__(self):
-            super().__init__(exit_code=137, logs=[b"start\n"])
+    agent._run_job({"job_id": "job-fail-override", "config_path": "cfg.yaml", "job_name": "Demo"})
 
-        def wait(self):
-            for _ in range(20):
-                if self.stop_called:
-                    return {"StatusCode": 137}
-                time.sleep(0.01)
-            return {"StatusCode": 0}
+    assert container.stop_called is True
+    status_calls = [call["json"]["status"] for call in session.calls_by_endpoint["job-status"]]
+    assert status_calls
+    assert all(status == "running" for status in status_calls)
 
-    container = FailedContainer()
-    docker_client = DummyDockerClient(container)
 
+def test_default_session_uses_pooled_adapter(tmp_path, noop_docker):
     agent = WorkerAgent(
         server_url="http://server",
         worker_id="worker-a",
-        shared_dir=str(shared_dir),
-        image="my-image",
-        session=session,
-        docker_client_factory=lambda: docker_client,
-        status_poll_interval=0.05,
-        heartbeat_interval=0.0,
+        shared_dir=str(tmp_path),
+        image="img",
+        docker_client_factory=noop_docker,
     )
 
-    agent._run_job({"job_id": "job-fail-override", "config_path": "cfg.yaml", "job_name": "Demo"})
+    adapter = agent._session.get_adapter("http://server/api/agent/heartbeat")
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 0
 
-    assert container.stop_called is True
-    status_calls = [call["json"]["status"] for call in session.calls if call["url"].endswith("/job-status")]
-    assert status_calls
-    assert all(status == "running" for status in status_calls)
+    agent._reset_session()
+    assert agent._session.get_adapter("http://server/api/agent/heartbeat")._pool_maxsize == 8
 
 
-def test_heartbeat_retries_and_updates_timestamp_only_on_success(monkeypatch):
+def test_heartbeat_retries_and_updates_timestamp_only_on_success(make_agent, noop_docker, monkeypatch):
     session = DummySession()
-    session.heartbeat_responses = [
-        DummyResponse(500, {}),
-        DummyResponse(503, {}),
-        DummyResponse(200, {}),
-    ]
-    monkeypatch.setattr("worker_agent.agent.time.sleep", lambda _seconds: None)
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
+    session.heartbeat_responses.extend(
+        [
+            DummyResponse(500, {}),
+            DummyResponse(503, {}),
+            DummyResponse(200, {}),
+        ]
     )
+    monkeypatch.setattr("worker_agent.agent.time.sleep", lambda _seconds: None)
+    agent, _, _ = make_agent(session=session, image="img", docker_client_factory=noop_docker)
     assert agent._last_heartbeat == 0.0
 
     agent._send_heartbeat(force=True)
 
-    heartbeat_calls = [call for call in session.calls if call["url"].endswith("/heartbeat")]
+    heartbeat_calls = session.calls_by_endpoint["heartbeat"]
     assert len(heartbeat_calls) == 3
     assert agent._last_heartbeat > 0
 
 
-def test_terminal_status_is_buffered_and_flushed_after_retryable_failures(monkeypatch):
+def test_heartbeat_is_throttled_by_interval(make_agent, noop_docker):
+    agent, session, _ = make_agent(docker_client_factory=noop_docker, heartbeat_interval=30)
+
+    agent._send_heartbeat()
+    agent._send_heartbeat()
+    assert len(session.calls_by_endpoint["heartbeat"]) == 1
+
+    agent._send_heartbeat(force=True)
+    assert len(session.calls_by_endpoint["heartbeat"]) == 2
+
+
+def test_fetch_status_revalidates_with_etag(make_agent, noop_docker):
+    class EtagSession(DummySession):
+        def get(self, url, timeout=None, headers=None):
+            self.calls_by_endpoint["status"].append({"url": url, "headers": headers})
+            if headers and headers.get("If-None-Match") == '"v1"':
+                return DummyResponse(304)
+            return DummyResponse(200, {"status": "running"}, headers={"ETag": '"v1"'})
+
+    agent, session, _ = make_agent(session=EtagSession(), docker_client_factory=noop_docker)
+    agent._register_active_job("job-etag")
+
+    assert agent._fetch_status_conditional("job-etag") == ("running", False)
+    assert agent._fetch_status_conditional("job-etag") == ("running", True)
+    assert session.calls_by_endpoint["status"][-1]["headers"] == {"If-None-Match": '"v1"'}
+
+    agent._unregister_active_job("job-etag")
+    assert agent._fetch_status("job-etag") == "running"
+    assert session.calls_by_endpoint["status"][-1]["headers"] is None
+    assert agent._status_etags == {}, "unregistered jobs must not keep cached ETags"
+
+
+def test_default_volumes_and_device_requests_are_reused(make_agent, noop_docker):
+    agent, _, _ = make_agent(docker_client_factory=noop_docker)
+    agent._gpu_request_enabled = True
+
+    assert agent._build_volumes(None) is agent._build_volumes([])
+    assert agent._build_volumes(None) == {agent.shared_dir: {"bind": "/data", "mode": "rw"}}
+    assert agent._build_volumes([{"host": "/h", "container": "/c"}]) == {"/h": {"bind": "/c", "mode": "rw"}}
+    assert agent._build_device_requests() is agent._build_device_requests({"job_id": "j"})
+    assert agent._build_device_requests({"device_requests": ["custom"]}) == ["custom"]
+
+
+@pytest.mark.parametrize(
+    ("error", "gpu_disabled"),
+    [
+        (RuntimeError('could not select device driver "" with capabilities: [[gpu]]'), True),
+        (RuntimeError("nvidia-container-cli: initialization error: nvml error: driver not loaded"), True),
+        (RuntimeError("CUDA error: out of memory"), False),
+        (RuntimeError("nvidia-container-cli: requirement error: unsatisfied condition: cuda>=12.4"), False),
+        (RuntimeError("error gathering device information while adding custom device: no such device"), False),
+    ],
+)
+def test_gpu_requests_disabled_only_after_driver_failure(make_agent, error, gpu_disabled):
+    docker_client = NoGpuDockerClient(DummyContainer(exit_code=0), error)
+    agent, session, _ = make_agent(docker_client=docker_client)
+    agent._gpu_request_enabled = True
+
+    agent._run_job({"job_id": "job-gpu-1", "config_path": "cfg.yaml"})
+    agent._run_job({"job_id": "job-gpu-2", "config_path": "cfg.yaml"})
+
+    assert agent._gpu_request_enabled is not gpu_disabled
+    gpu_attempts = [call for call in docker_client.run_calls if call.get("device_requests")]
+    assert len(gpu_attempts) == (1 if gpu_disabled else 2)
+    assert session.calls_by_endpoint["job-status"][-1]["json"]["status"] == "finished"
+
+
+def test_status_watcher_keeps_cadence_after_slow_fetch(watched_job, monkeypatch):
+    agent, executor, entry, clock = watched_job
+
+    def slow_fetch(job_id):
+        clock["now"] += 3.0
+        return "running", False
+
+    monkeypatch.setattr(agent, "_fetch_status_conditional", slow_fetch)
+    monkeypatch.setattr(agent, "_post_status", lambda *args, **kwargs: None)
+    assert entry["next_poll_at"] == 110.0
+
+    clock["now"] = 110.0
+    executor._poll_watched_job("job-1", entry)
+    assert entry["next_poll_at"] == 120.0
+
+    clock["now"] = 135.0
+    executor._poll_watched_job("job-1", entry)
+    assert entry["next_poll_at"] == 148.0
+
+
+def test_status_watcher_keeps_cadence_when_fetch_raises(watched_job, monkeypatch):
+    agent, executor, entry, clock = watched_job
+    fetches = []
+
+    def broken_fetch(job_id):
+        fetches.append(clock["now"])
+        raise AttributeError("'list' object has no attribute 'get'")
+
+    monkeypatch.setattr(agent, "_fetch_status_conditional", broken_fetch)
+
+    clock["now"] = 110.0
+    with pytest.raises(AttributeError):
+        executor._poll_watched_job("job-1", entry)
+    assert entry["next_poll_at"] == 120.0
+
+    executor._poll_watched_job("job-1", entry)
+    assert fetches == [110.0], "a failed fetch must not be retried before the next deadline"
+
+
+def test_fetch_status_treats_non_object_body_as_unknown(make_agent, noop_docker):
+    class ListBodySession(DummySession):
+        def get(self, url, timeout=None, headers=None):
+            return DummyResponse(200, ["running"])
+
+    agent, _, _ = make_agent(session=ListBodySession(), docker_client_factory=noop_docker)
+
+    assert agent._fetch_status_conditional("job-list") == (None, False)
+
+
+def test_status_watcher_backs_off_on_not_modified_and_resets_on_change(watched_job, monkeypatch):
+    agent, executor, entry, clock = watched_job
+    responses = deque([("running", True)] * 4 + [("running", False)])
+    monkeypatch.setattr(agent, "_fetch_status_conditional", lambda job_id: responses.popleft())
+    monkeypatch.setattr(agent, "_post_status", lambda *args, **kwargs: None)
+
+    intervals = []
+    while responses:
+        clock["now"] = entry["next_poll_at"]
+        executor._poll_watched_job("job-1", entry)
+        intervals.append(entry["poll_interval"])
+
+    assert intervals == [20, 40, 60.0, 60.0, 10]
+
+
+def test_heartbeat_loop_keeps_heartbeats_off_the_poll_path(make_agent, noop_docker):
+    agent, session, _ = make_agent(docker_client_factory=noop_docker, heartbeat_interval=30)
+    heartbeats = session.calls_by_endpoint["heartbeat"]
+    heartbeat_posted = session.posted["heartbeat"]
+
+    agent._start_heartbeat_loop()
+    try:
+        assert heartbeat_posted.wait(timeout=1), "loop should heartbeat on start"
+        heartbeat_posted.clear()
+
+        agent.poll_once()
+        assert len(heartbeats) == 1
+
+        agent._request_heartbeat()
+        assert heartbeat_posted.wait(timeout=1), "requested heartbeat should wake the loop"
+        assert len(heartbeats) == 2
+    finally:
+        agent.stop()
+        agent._heartbeat_thread.join(timeout=1)
+    assert not agent._heartbeat_thread.is_alive()
+
+
+def test_session_is_reset_only_on_transport_failures(make_agent, noop_docker, monkeypatch):
     session = DummySession()
-    session.job_status_post_responses = [
-        DummyResponse(500, {}),
-        DummyResponse(503, {}),
-        DummyResponse(502, {}),
-        DummyResponse(200, {}),
-    ]
+    session.heartbeat_responses.extend([DummyResponse(503, {}), DummyResponse(200, {})])
     monkeypatch.setattr("worker_agent.agent.time.sleep", lambda _seconds: None)
+    agent, _, _ = make_agent(session=session, docker_client_factory=noop_docker)
+    resets = []
+    monkeypatch.setattr(agent, "_reset_session", lambda: resets.append(True))
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
+    agent._send_heartbeat(force=True)
+    assert resets == []
+
+    agent._handle_request_exception("heartbeat", requests.ConnectionError("refused"))
+    assert resets == [True]
+
+
+def test_terminal_status_is_buffered_and_flushed_after_retryable_failures(make_agent, noop_docker, monkeypatch):
+    session = DummySession()
+    session.job_status_post_responses.extend(
+        [
+            DummyResponse(500, {}),
+            DummyResponse(503, {}),
+            DummyResponse(502, {}),
+            DummyResponse(200, {}),
+        ]
     )
+    monkeypatch.setattr("worker_agent.agent.time.sleep", lambda _seconds: None)
+    agent, _, _ = make_agent(session=session, image="img", docker_client_factory=noop_docker)
 
     agent._post_status("job-buffer", "finished", exit_code=0)
     assert len(agent._pending_terminal_statuses) == 1
@@ -581,52 +739,60 @@ def test_terminal_status_is_buffered_and_flushed_after_retryable_failures(monkey
     agent._flush_pending_terminal_statuses(force=True)
     assert len(agent._pending_terminal_statuses) == 0
 
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = session.calls_by_endpoint["job-status"]
     assert len(status_calls) == 4
 
 
-def test_terminal_status_non_retryable_4xx_is_not_buffered():
-    session = DummySession()
-    session.job_status_post_responses = [DummyResponse(400, {})]
+def test_status_sender_delivers_queued_statuses_before_stopping(make_agent, noop_docker):
+    agent, session, _ = make_agent(docker_client_factory=noop_docker)
 
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
-    )
+    agent._start_status_sender()
+    agent._post_status("job-queued", "running", container_id="cid")
+    agent._post_status("job-queued", "finished", exit_code=0)
+    agent._stop_status_sender()
+
+    assert not agent._status_sender_running()
+    statuses = [call["json"]["status"] for call in session.calls_by_endpoint["job-status"]]
+    assert statuses == ["running", "finished"]
+
+
+def test_status_coalescing_drops_only_identical_non_terminal_updates():
+    payloads = [
+        {"job_id": "a", "status": "running", "container_id": "cid"},
+        {"job_id": "a", "status": "running", "container_id": "cid"},
+        {"job_id": "b", "status": "dispatched", "container_name": "job-b"},
+        {"job_id": "b", "status": "dispatched", "details": {"executor_stage": "submit"}},
+        {"job_id": "b", "status": "dispatched", "details": {"executor_stage": "queued"}},
+        {"job_id": "a", "status": "finished"},
+        {"job_id": "a", "status": "finished"},
+    ]
+
+    kept = WorkerAgent._coalesce_status_payloads(payloads)
+
+    assert kept == payloads[1:]
+
+
+def test_terminal_status_non_retryable_4xx_is_not_buffered(make_agent, noop_docker):
+    session = DummySession()
+    session.job_status_post_responses.extend([DummyResponse(400, {})])
+    agent, _, _ = make_agent(session=session, image="img", docker_client_factory=noop_docker)
 
     agent._post_status("job-4xx", "finished", exit_code=0)
     assert len(agent._pending_terminal_statuses) == 0
 
-    status_calls = [call for call in session.calls if call["url"].endswith("/job-status")]
+    status_calls = session.calls_by_endpoint["job-status"]
     assert len(status_calls) == 1
 
 
-def test_heartbeat_payload_contains_runtime_metadata():
-    session = DummySession()
-
-    agent = WorkerAgent(
-        server_url="http://server",
-        worker_id="worker-a",
-        shared_dir="/tmp",
-        image="img",
-        session=session,
-        docker_client_factory=lambda: DummyDockerClient(DummyContainer()),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
-    )
+def test_heartbeat_payload_contains_runtime_metadata(make_agent, noop_docker):
+    agent, session, _ = make_agent(image="img", docker_client_factory=noop_docker)
     agent._mark_active_job("job-meta")
     agent._post_status("job-meta", "running")
     agent._post_status("job-meta", "finished", exit_code=0)
     agent._mark_active_job(None)
     agent._send_heartbeat(force=True)
 
-    heartbeat_calls = [call for call in session.calls if call["url"].endswith("/heartbeat")]
+    heartbeat_calls = session.calls_by_endpoint["heartbeat"]
     assert heartbeat_calls
     payload = heartbeat_calls[-1]["json"]
     info = payload["info"]
@@ -639,9 +805,7 @@ def test_heartbeat_payload_contains_runtime_metadata():
     assert info["last_terminal_status"] == "finished"
 
 
-def test_deucalion_defaults_to_three_active_slots():
-    session = DummySession()
-
+def test_deucalion_defaults_to_three_active_slots(make_agent):
     class NoopExecutor:
         def run_job(self, job):  # pragma: no cover - should not run in this test
             return None
@@ -652,22 +816,17 @@ def test_deucalion_defaults_to_three_active_slots():
         def close(self):
             return None
 
-    agent = WorkerAgent(
-        server_url="http://server",
+    agent, _, _ = make_agent(
         worker_id="deucalion",
-        shared_dir="/tmp",
         image="img",
-        session=session,
         executor="deucalion",
         deucalion_executor_factory=lambda runtime: NoopExecutor(),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
     )
 
     assert agent.max_active_jobs == 3
 
 
-def test_deucalion_poll_once_fills_only_available_slots():
+def test_deucalion_poll_once_fills_only_available_slots(make_agent):
     session = DummySession()
     release_jobs = threading.Event()
     started_jobs: list[str] = []
@@ -695,17 +854,13 @@ def test_deucalion_poll_once_fills_only_available_slots():
             DummyResponse(200, {"job_id": f"job-{idx}", "config_path": "cfg.yaml", "job_name": f"Demo {idx}"})
         )
 
-    agent = WorkerAgent(
-        server_url="http://server",
+    agent, _, _ = make_agent(
+        session=session,
         worker_id="deucalion",
-        shared_dir="/tmp",
         image="img",
-        session=session,
         executor="deucalion",
         deucalion_executor_factory=lambda runtime: BlockingExecutor(runtime),
         env={"DEUCALION_MAX_ACTIVE_JOBS": "3"},
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
     )
 
     handled = agent.poll_once()
@@ -713,7 +868,7 @@ def test_deucalion_poll_once_fills_only_available_slots():
     assert len(started_jobs) == 3
     assert agent._running_thread_count() == 3
 
-    next_job_calls = [call for call in session.calls if call["url"].endswith("/next-job")]
+    next_job_calls = session.calls_by_endpoint["next-job"]
     assert len(next_job_calls) == 3
 
     release_jobs.set()
@@ -721,23 +876,16 @@ def test_deucalion_poll_once_fills_only_available_slots():
     assert agent._running_thread_count() == 0
 
 
-def test_heartbeat_payload_includes_multiple_active_jobs_details():
-    session = DummySession()
-
-    agent = WorkerAgent(
-        server_url="http://server",
+def test_heartbeat_payload_includes_multiple_active_jobs_details(make_agent):
+    agent, session, _ = make_agent(
         worker_id="deucalion",
-        shared_dir="/tmp",
         image="img",
-        session=session,
         executor="deucalion",
         deucalion_executor_factory=lambda runtime: type(
             "NoopExecutor",
             (),
             {"run_job": lambda self, job: None, "heartbeat_info": lambda self: {}, "close": lambda self: None},
         )(),
-        heartbeat_interval=0,
-        status_poll_interval=0.0,
     )
 
     agent._register_active_job("job-a")
@@ -761,7 +909,7 @@ def test_heartbeat_payload_includes_multiple_active_jobs_details():
 
     agent._send_heartbeat(force=True)
 
-    heartbeat_calls = [call for call in session.calls if call["url"].endswith("/heartbeat")]
+    heartbeat_calls = session.calls_by_endpoint["heartbeat"]
     assert heartbeat_calls
     info = heartbeat_calls[-1]["json"]["info"]
 
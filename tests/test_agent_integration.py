@@ -1,7 +1,7 @@
 import threading
-import time
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Deque, Dict, List, Optional
 
 import pytest
 
@@ -29,6 +29,7 @@ class FakeResponse:
     def __init__(self, status_code: int, data: Optional[Dict[str, str]] = None):
         self.status_code = status_code
         self._data = data or {}
+        self.headers: Dict[str, str] = {}
 
     def json(self) -> Dict[str, str]:
         return self._data
@@ -42,9 +43,9 @@ class ScriptedBackendSession:
     def __init__(self, jobs: List[ScriptedJob]):
         self._jobs = list(jobs)
         self._lock = threading.Lock()
-        self._job_queue: List[ScriptedJob] = list(jobs)
-        self.status_sequences: Dict[str, List[str]] = {
-            job.job_id: list(job.status_sequence) for job in jobs
+        self._job_queue: Deque[ScriptedJob] = deque(jobs)
+        self.status_sequences: Dict[str, Deque[str]] = {
+            job.job_id: deque(job.status_sequence) for job in jobs
         }
         self.last_status: Dict[str, str] = {job.job_id: "running" for job in jobs}
         self.heartbeats: List[Dict[str, str]] = []
@@ -53,29 +54,40 @@ class ScriptedBackendSession:
         self.status_calls: Dict[str, int] = {job.job_id: 0 for job in jobs}
         self._final_jobs_reported: set[str] = set()
         self.all_jobs_done = threading.Event()
+        self._post_handlers = {
+            "heartbeat": self._on_heartbeat,
+            "next-job": self._on_next_job,
+            "job-status": self._on_job_status,
+        }
 
     def post(self, url: str, json: Optional[Dict[str, str]] = None, timeout: Optional[float] = None):
-        if url.endswith("/heartbeat"):
-            if json is not None:
-                self.heartbeats.append(json)
-            return FakeResponse(200, {})
-        if url.endswith("/next-job"):
-            with self._lock:
-                self.next_job_calls += 1
-                if self._job_queue:
-                    job = self._job_queue.pop(0)
-                    return FakeResponse(200, job.payload())
-            return FakeResponse(204, {})
-        if url.endswith("/job-status"):
-            if json is not None:
-                self.job_status_posts.append(json)
-                status = json.get("status")
-                job_id = json.get("job_id")
-                if status in {"finished", "failed", "canceled", "stopped"} and job_id:
-                    self._final_jobs_reported.add(job_id)
-                    if len(self._final_jobs_reported) == len(self._jobs):
-                        self.all_jobs_done.set()
-            return FakeResponse(200, {})
+        return self._post_handlers.get(url.rsplit("/", 1)[-1], self._default_ok)(json)
+
+    def _default_ok(self, json: Optional[Dict[str, str]]) -> FakeResponse:
+        return FakeResponse(200, {})
+
+    def _on_heartbeat(self, json: Optional[Dict[str, str]]) -> FakeResponse:
+        if json is not None:
+            self.heartbeats.append(json)
+        return FakeResponse(200, {})
+
+    def _on_next_job(self, json: Optional[Dict[str, str]]) -> FakeResponse:
+        with self._lock:
+            self.next_job_calls += 1
+            if self._job_queue:
+                job = self._job_queue.popleft()
+                return FakeResponse(200, job.payload())
+        return FakeResponse(204, {})
+
+    def _on_job_status(self, json: Optional[Dict[str, str]]) -> FakeResponse:
+        if json is not None:
+            self.job_status_posts.append(json)
+            status = json.get("status")
+            job_id = json.get("job_id")
+            if status in {"finished", "failed", "canceled", "stopped"} and job_id:
+                self._final_jobs_reported.add(job_id)
+                if len(self._final_jobs_reported) == len(self._jobs):
+                    self.all_jobs_done.set()
         return FakeResponse(200, {})
 
     def get(self, url: str, timeout: Optional[float] = None):
@@ -84,7 +96,7 @@ class ScriptedBackendSession:
             return FakeResponse(404, {})
         queue = self.status_sequences[job_id]
         if queue:
-            status = queue.pop(0)
+            status = queue.popleft()
             self.last_status[job_id] = status
         else:
             status = self.last_status[job_id]
@@ -95,19 +107,20 @@ class ScriptedBackendSession:
 class ScriptedContainer:
     def __init__(self, job: ScriptedJob):
         self._job = job
+        self._expect_cancel = "canceled" in job.status_sequence
+        self._logs = b"".join(job.logs)
         self.id = f"cid-{job.job_id}"
         self.name = job.job_name
         self.stop_called = threading.Event()
         self.removed = False
 
     def logs(self, stream: bool = True, follow: bool = True):
-        for chunk in self._job.logs:
-            yield chunk
+        yield self._logs
 
     def wait(self):
-        if self.stop_called.wait(timeout=0.5):
-            return {"StatusCode": self._job.exit_code}
-        time.sleep(0.05)
+        if self._expect_cancel:
+            # Block until the worker's status monitor stops the container.
+            self.stop_called.wait(timeout=0.5)
         return {"StatusCode": self._job.exit_code}
 
     def stop(self):
@@ -160,9 +173,6 @@ class ScriptedDockerClient:
 
 
 def test_worker_run_forever_integration(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-
     jobs = [
         ScriptedJob(
             job_id="job-success",
@@ -188,11 +198,11 @@ def test_worker_run_forever_integration(tmp_path):
     agent = WorkerAgent(
         server_url="http://backend",
         worker_id="worker-int",
-        shared_dir=str(shared_dir),
+        shared_dir=str(tmp_path),
         image="test-image",
-        poll_interval=0.01,
-        heartbeat_interval=0.01,
-        status_poll_interval=0.02,
+        poll_interval=0,
+        heartbeat_interval=0,
+        status_poll_interval=0.001,
         session=backend,
         docker_client_factory=lambda: docker_client,
     )
@@ -227,13 +237,13 @@ def test_worker_run_forever_integration(tmp_path):
     run_commands = {call["job_id"]: call for call in docker_client.run_calls}
     assert "--config /data/cfg/success.yaml" in run_commands["job-success"]["command"]
     assert "--job_id job-success" in run_commands["job-success"]["command"]
-    assert run_commands["job-success"]["volumes"] == {str(shared_dir): {"bind": "/data", "mode": "rw"}}
+    assert run_commands["job-success"]["volumes"] == {str(tmp_path): {"bind": "/data", "mode": "rw"}}
     assert run_commands["job-success"]["labels"]["opeva.job_id"] == "job-success"
     assert run_commands["job-success"]["labels"]["opeva.worker_id"] == "worker-int"
 
     # Log files created for each job.
-    success_log = shared_dir / "jobs" / "job-success" / "logs" / "job-success.log"
-    cancel_log = shared_dir / "jobs" / "job-cancel" / "logs" / "job-cancel.log"
+    success_log = tmp_path / "jobs" / "job-success" / "logs" / "job-success.log"
+    cancel_log = tmp_path / "jobs" / "job-cancel" / "logs" / "job-cancel.log"
     assert success_log.exists()
     assert cancel_log.exists()
     assert "success line" in success_log.read_text()
@@ -246,9 +256,6 @@ def test_worker_run_forever_integration(tmp_path):
 
 
 def test_worker_gpu_auto_fallback(tmp_path):
-    shared_dir = tmp_path / "shared"
-    shared_dir.mkdir()
-
     job = ScriptedJob(
         job_id="job-gpu",
         config_path="cfg/gpu.yaml",
@@ -263,11 +270,11 @@ def test_worker_gpu_auto_fallback(tmp_path):
     agent = WorkerAgent(
         server_url="http://backend",
         worker_id="worker-gpu",
-        shared_dir=str(shared_dir),
+        shared_dir=str(tmp_path),
         image="test-image",
-        poll_interval=0.01,
-        heartbeat_interval=0.01,
-        status_poll_interval=0.02,
+        poll_interval=0,
+        heartbeat_interval=0,
+        status_poll_interval=0.001,
         session=backend,
         docker_client_factory=lambda: docker_client,
     )
@@ -283,3 +290,4 @@ def test_worker_gpu_auto_fallback(tmp_path):
     assert len(docker_client.run_calls) >= 2
     assert docker_client.run_calls[0]["device_requests"], "first attempt should request GPU"
     assert docker_client.run_calls[-1]["device_requests"] is None, "fallback should omit GPU request"
+    assert agent._gpu_request_enabled is True, "generic run errors must not disable GPU requests"
@@ -1,3 +1,5 @@
+import signal
+import subprocess
 import sys
 
 import pytest
@@ -5,21 +7,28 @@ import pytest
 from worker_agent import cli
 
 
-class DummyAgent:
-    def __init__(self, **kwargs):
-        self.kwargs = kwargs
-        DummyAgent.instances.append(self)
+@pytest.fixture
+def dummy_agent(monkeypatch):
+    instances = []
 
-    def run_forever(self):
-        DummyAgent.ran = True
+    class DummyAgent:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+            self.ran = False
+            self.exit_requested = False
+            instances.append(self)
 
+        def run_forever(self):
+            self.ran = True
 
-DummyAgent.instances = []
-DummyAgent.ran = False
+        def request_exit_after_current_job(self):
+            self.exit_requested = True
 
-
-def test_cli_uses_worker_id(monkeypatch):
     monkeypatch.setattr(cli, "WorkerAgent", DummyAgent)
+    return instances
+
+
+def test_cli_uses_worker_id(monkeypatch, dummy_agent):
     monkeypatch.setenv("WORKER_ID", "env-worker")
     monkeypatch.setenv("OPEVA_SERVER", "http://example")
     monkeypatch.setenv("OPEVA_SHARED_DIR", "/shared")
@@ -27,14 +36,15 @@ def test_cli_uses_worker_id(monkeypatch):
     monkeypatch.setenv("LOG_LEVEL", "DEBUG")
     monkeypatch.setenv("WORKER_HEARTBEAT_INTERVAL", "10")
     monkeypatch.setenv("WORKER_EXIT_AFTER_JOB", "1")
+    monkeypatch.setenv("WORKER_NEXT_JOB_WAIT", "25")
 
     argv = ["cli", "--poll-interval", "1"]
     monkeypatch.setattr(sys, "argv", argv)
 
     cli.main()
 
-    assert DummyAgent.ran is True
-    agent_kwargs = DummyAgent.instances[0].kwargs
+    assert dummy_agent[0].ran is True
+    agent_kwargs = dummy_agent[0].kwargs
     assert agent_kwargs["worker_id"] == "env-worker"
     assert agent_kwargs["server_url"] == "http://example"
     assert agent_kwargs["shared_dir"] == "/shared"
@@ -44,12 +54,10 @@ def test_cli_uses_worker_id(monkeypatch):
     assert agent_kwargs["status_poll_interval"] == 10.0
     assert agent_kwargs["heartbeat_interval"] == 10.0
     assert agent_kwargs["exit_after_job"] is True
+    assert agent_kwargs["next_job_wait"] == 25.0
 
 
-def test_cli_defaults_hostname(monkeypatch):
-    DummyAgent.instances.clear()
-    DummyAgent.ran = False
-    monkeypatch.setattr(cli, "WorkerAgent", DummyAgent)
+def test_cli_defaults_hostname(monkeypatch, dummy_agent):
     monkeypatch.delenv("WORKER_ID", raising=False)
     monkeypatch.setenv("OPEVA_SERVER", "http://example")
     monkeypatch.setattr(cli, "socket", type("S", (), {"gethostname": staticmethod(lambda: "host-name")})())
@@ -59,5 +67,22 @@ def test_cli_defaults_hostname(monkeypatch):
 
     cli.main()
 
-    assert DummyAgent.instances[0].kwargs["worker_id"] == "host-name"
-    assert DummyAgent.instances[0].kwargs["exit_after_job"] is False
+    assert dummy_agent[0].kwargs["worker_id"] == "host-name"
+    assert dummy_agent[0].kwargs["exit_after_job"] is False
+
+
+def test_cli_wires_sigusr1_to_exit_after_job(monkeypatch, dummy_agent):
+    handlers = {}
+    monkeypatch.setattr(cli.signal, "signal", lambda signum, handler: handlers.setdefault(signum, handler))
+    monkeypatch.setattr(sys, "argv", ["cli"])
+
+    cli.main()
+
+    assert dummy_agent[0].exit_requested is False
+    handlers[signal.SIGUSR1](signal.SIGUSR1, None)
+    assert dummy_agent[0].exit_requested is True
+
+
+def test_cli_import_defers_docker_sdk():
+    code = "import sys, worker_agent.cli; sys.exit('docker' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
@@ -17,6 +17,7 @@ class DummyResponse:
     def __init__(self, status_code, data=None):
         self.status_code = status_code
         self._data = data or {}
+        self.headers = {}
 
     def json(self):
         return self._data
@@ -5,17 +5,15 @@ from collections import deque
 from importlib.metadata import PackageNotFoundError, version
 import logging
 import os
+import queue
+import re
 import threading
 import time
 from pathlib import Path
 from typing import Any, Callable, Dict, Mapping, Optional
 
 import requests
-
-try:  # docker is optional at import time for tooling
-    from docker.types import DeviceRequest
-except ImportError:  # pragma: no cover - older docker SDK or missing package
-    DeviceRequest = None  # type: ignore
+from requests.adapters import HTTPAdapter
 
 from .executors.base import BaseExecutor
 from .executors.deucalion_executor import DeucalionExecutor
@@ -30,13 +28,45 @@ _RETRY_MAX_BACKOFF_SECONDS = 5.0
 _TERMINAL_QUEUE_MAX_BACKOFF_SECONDS = 30.0
 _TERMINAL_JOB_STATUSES = {"finished", "failed", "stopped", "canceled"}
 _JOB_THREAD_SHUTDOWN_TIMEOUT_SECONDS = 5.0
+_HEARTBEAT_TIMEOUT_SECONDS = 5.0
+_NEXT_JOB_TIMEOUT_SECONDS = 30.0
+_STATUS_SENDER_SHUTDOWN_TIMEOUT_SECONDS = 30.0
+_HEARTBEAT_SHUTDOWN_TIMEOUT_SECONDS = 20.0
+_HTTP_POOL_CONNECTIONS = 4
+_HTTP_POOL_MAXSIZE = 8
+_CONTAINER_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+_TRUTHY_ENV_VALUES = frozenset({"1", "true", "yes", "on"})
+_LOG_LEVELS = {
+    "NOTSET": logging.NOTSET,
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARN": logging.WARNING,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+    "FATAL": logging.CRITICAL,
+}
 
 
 def _env_flag(name: str, default: bool = False) -> bool:
     value = os.environ.get(name)
     if value is None:
         return default
-    return value.strip().lower() in {"1", "true", "yes", "on"}
+    return value.strip().lower() in _TRUTHY_ENV_VALUES
+
+
+def _build_http_session() -> requests.Session:
+    # Keep-alive pool shared by heartbeats, polls and status calls; retries are
+    # handled by the agent itself, so urllib3 must not retry underneath it.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=_HTTP_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 class WorkerAgent:
@@ -51,6 +81,7 @@ class WorkerAgent:
         poll_interval: float = 5.0,
         heartbeat_interval: float = 30.0,
         status_poll_interval: float = 10.0,
+        next_job_wait: float = 0.0,
         exit_after_job: bool = False,
         session: Optional[requests.Session] = None,
         docker_client_factory: Optional[Callable[[], Any]] = None,
@@ -59,18 +90,32 @@ class WorkerAgent:
         deucalion_executor_factory: Optional[Callable[["WorkerAgent"], BaseExecutor]] = None,
     ) -> None:
         self.server_url = server_url.rstrip("/")
+        self._heartbeat_url = f"{self.server_url}/api/agent/heartbeat"
+        self._next_job_url = f"{self.server_url}/api/agent/next-job"
+        self._job_status_url = f"{self.server_url}/api/agent/job-status"
+        self._status_url_prefix = f"{self.server_url}/status/"
         self.worker_id = worker_id
+        self._container_name_prefix = f"job_{_CONTAINER_NAME_UNSAFE.sub('_', worker_id)}_"
         self.shared_dir = shared_dir
+        self._jobs_root = Path(shared_dir) / "jobs"
+        self._jobs_root_prepared = False
+        self._default_volumes: Dict[str, Dict[str, str]] = {shared_dir: {"bind": "/data", "mode": "rw"}}
         self.image = image
         self.poll_interval = poll_interval
         self.heartbeat_interval = heartbeat_interval
         self.status_poll_interval = status_poll_interval
+        self.next_job_wait = max(0.0, next_job_wait)
         self._exit_after_job = exit_after_job
         self._last_heartbeat = 0.0
         self._stop_event = threading.Event()
         self._heartbeat_thread: Optional[threading.Thread] = None
+        self._heartbeat_wakeup = threading.Event()
+        self._heartbeat_requested = threading.Event()
         self._external_session = session is not None
-        self._session = session or requests.Session()
+        self._session = session or _build_http_session()
+        # next-job is only called from the polling loop and may be held open by
+        # the backend (long-poll), so it gets its own unlocked session.
+        self._next_job_session = session or _build_http_session()
         self._state_lock = threading.Lock()
         self._session_lock = threading.Lock()
         self._active_jobs: dict[str, dict[str, Any]] = {}
@@ -78,10 +123,14 @@ class WorkerAgent:
         self._last_job_id: Optional[str] = None
         self._last_terminal_status: Optional[str] = None
         self._gpu_request_enabled = _env_flag("WORKER_ENABLE_GPU", False)
+        self._default_device_requests: Optional[list] = None
         self._last_request_failure: Optional[str] = None
         self._has_processed_job = False
         self._pending_terminal_statuses: deque[dict[str, Any]] = deque()
         self._pending_terminal_statuses_lock = threading.Lock()
+        self._status_etags: dict[str, tuple[str, Optional[str]]] = {}
+        self._status_queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._status_sender_thread: Optional[threading.Thread] = None
         self._env = dict(env or os.environ)
 
         self.executor = (executor or self._env.get("WORKER_EXECUTOR", "docker")).strip().lower()
@@ -141,6 +190,7 @@ class WorkerAgent:
     def _unregister_active_job(self, job_id: str) -> None:
         with self._state_lock:
             self._active_jobs.pop(job_id, None)
+            self._status_etags.pop(job_id, None)
 
     def _update_active_job(self, job_id: str, **fields: object) -> None:
         with self._state_lock:
@@ -210,6 +260,7 @@ class WorkerAgent:
 
     def stop(self) -> None:
         self._stop_event.set()
+        self._heartbeat_wakeup.set()
 
     def run_forever(self) -> None:
         _LOGGER.info(
@@ -224,25 +275,32 @@ class WorkerAgent:
         except Exception as exc:  # pragma: no cover - defensive
             _LOGGER.warning("Executor startup hook failed: %s", exc)
         self._start_heartbeat_loop()
+        self._start_status_sender()
         try:
             while not self._stop_event.is_set():
+                poll_started = time.monotonic()
                 handled = self.poll_once()
-                sleep_for = 0 if handled else self.poll_interval
-                if sleep_for > 0:
-                    time.sleep(sleep_for)
+                # Time spent inside the poll (e.g. a held long-poll) counts towards the interval.
+                sleep_for = 0 if handled else self.poll_interval - (time.monotonic() - poll_started)
+                if sleep_for > 0 and self._stop_event.wait(sleep_for):
+                    break
         except KeyboardInterrupt:
             _LOGGER.info("Worker interrupted, shutting down")
         finally:
             self._stop_event.set()
             if self._heartbeat_thread:
-                self._heartbeat_thread.join(timeout=2)
+                # Long enough for a heartbeat requested by the last job to be delivered.
+                self._heartbeat_thread.join(timeout=_HEARTBEAT_SHUTDOWN_TIMEOUT_SECONDS)
             self._join_job_threads(timeout=_JOB_THREAD_SHUTDOWN_TIMEOUT_SECONDS)
+            self._stop_status_sender()
+            self._flush_pending_terminal_statuses(force=True)
             self._executor.close()
 
     def poll_once(self) -> bool:
         self._reap_finished_job_threads()
         self._flush_pending_terminal_statuses()
-        self._send_heartbeat()
+        if not self._heartbeat_loop_running():
+            self._send_heartbeat()
         self._flush_pending_terminal_statuses()
         handled = False
 
@@ -330,7 +388,7 @@ class WorkerAgent:
 
     def _post_json_with_retries(
         self,
-        endpoint: str,
+        url: str,
         payload: Dict[str, Any],
         *,
         context: str,
@@ -343,7 +401,7 @@ class WorkerAgent:
             try:
                 with self._session_lock:
                     response = self._session.post(
-                        f"{self.server_url}{endpoint}",
+                        url,
                         json=payload,
                         timeout=timeout,
                     )
@@ -419,7 +477,7 @@ class WorkerAgent:
             payload = entry["payload"]
             job_id = payload.get("job_id", "unknown")
             result = self._post_json_with_retries(
-                "/api/agent/job-status",
+                self._job_status_url,
                 payload,
                 context=f"job-status({job_id})",
                 timeout=10,
@@ -447,9 +505,9 @@ class WorkerAgent:
             _LOGGER.error("Dropping pending terminal status for job %s after non-retryable response", job_id)
 
     def _send_heartbeat(self, force: bool = False) -> None:
-        now = time.time()
-        if not force:
-            if self.heartbeat_interval > 0 and (now - self._last_heartbeat) < self.heartbeat_interval:
+        now = time.monotonic()
+        if not force and self.heartbeat_interval > 0 and self._last_heartbeat:
+            if (now - self._last_heartbeat) < self.heartbeat_interval:
                 return
         payload = {
             "worker_id": self.worker_id,
@@ -457,27 +515,38 @@ class WorkerAgent:
         }
         _LOGGER.info("POST /api/agent/heartbeat payload=%s", payload)
         result = self._post_json_with_retries(
-            "/api/agent/heartbeat",
+            self._heartbeat_url,
             payload,
             context="heartbeat",
-            timeout=10,
+            timeout=_HEARTBEAT_TIMEOUT_SECONDS,
             warning=True,
         )
         if result["ok"]:
             self._last_heartbeat = now
 
+    def _request_heartbeat(self) -> None:
+        """Send a heartbeat now, handing it to the heartbeat thread when one is running."""
+        if self._heartbeat_loop_running():
+            self._heartbeat_requested.set()
+            self._heartbeat_wakeup.set()
+        else:
+            self._send_heartbeat(force=True)
+
     def _request_next_job(self) -> Optional[Dict[str, Any]]:
-        _LOGGER.info("POST /api/agent/next-job payload=%s", {"worker_id": self.worker_id})
+        payload: Dict[str, Any] = {"worker_id": self.worker_id}
+        if self.next_job_wait > 0:
+            # Ask the backend to hold the request until a job is queued (long-poll).
+            payload["wait"] = self.next_job_wait
+        _LOGGER.info("POST /api/agent/next-job payload=%s", payload)
         try:
-            with self._session_lock:
-                response = self._session.post(
-                    f"{self.server_url}/api/agent/next-job",
-                    json={"worker_id": self.worker_id},
-                    timeout=30,
-                )
+            response = self._next_job_session.post(
+                self._next_job_url,
+                json=payload,
+                timeout=_NEXT_JOB_TIMEOUT_SECONDS + self.next_job_wait,
+            )
             self._last_request_failure = None
         except requests.RequestException as exc:  # pragma: no cover
-            self._handle_request_exception("next-job", exc, warning=True)
+            self._handle_request_exception("next-job", exc, warning=True, reset=self._reset_next_job_session)
             return None
 
         if response.status_code == 204:
@@ -524,9 +593,17 @@ class WorkerAgent:
         self._update_active_job_from_status(job_id, status, dict(extra))
         payload = {"job_id": job_id, "status": status, "worker_id": self.worker_id}
         payload.update({k: v for k, v in extra.items() if v is not None})
+        if self._status_sender_running():
+            self._status_queue.put(payload)
+            return
+        self._deliver_status(payload)
+
+    def _deliver_status(self, payload: Dict[str, Any]) -> None:
+        job_id = payload.get("job_id")
+        status = payload.get("status")
         _LOGGER.info("POST /api/agent/job-status payload=%s", payload)
         result = self._post_json_with_retries(
-            "/api/agent/job-status",
+            self._job_status_url,
             payload,
             context=f"job-status({job_id})",
             timeout=10,
@@ -536,18 +613,42 @@ class WorkerAgent:
             self._enqueue_pending_terminal_status(payload)
 
     def _fetch_status(self, job_id: str) -> Optional[str]:
+        return self._fetch_status_conditional(job_id)[0]
+
+    def _fetch_status_conditional(self, job_id: str) -> tuple[Optional[str], bool]:
+        """Fetch the backend status, returning ``(status, not_modified)``.
+
+        When the backend tags status responses with an ``ETag`` the next request
+        revalidates with ``If-None-Match``; a ``304`` reuses the cached status.
+        """
         _LOGGER.info("GET /status/%s", job_id)
+        with self._state_lock:
+            cached = self._status_etags.get(job_id)
+        request_kwargs: dict[str, Any] = {"timeout": 10}
+        if cached is not None:
+            request_kwargs["headers"] = {"If-None-Match": cached[0]}
         try:
             with self._session_lock:
-                response = self._session.get(f"{self.server_url}/status/{job_id}", timeout=10)
+                response = self._session.get(f"{self._status_url_prefix}{job_id}", **request_kwargs)
+            if response.status_code == 304 and cached is not None:
+                return cached[1], True
             if response.status_code == 404:
-                return None
+                return None, False
             response.raise_for_status()
             payload = response.json()
-            return payload.get("status")
+            status = payload.get("status") if isinstance(payload, dict) else None
+            etag = response.headers.get("ETag")
+            with self._state_lock:
+                # Only active jobs are cached: one-off lookups (e.g. orphan container
+                # checks) are never unregistered and would otherwise accumulate.
+                if etag and job_id in self._active_jobs:
+                    self._status_etags[job_id] = (etag, status)
+                else:
+                    self._status_etags.pop(job_id, None)
+            return status, False
         except requests.RequestException as exc:  # pragma: no cover
             _LOGGER.warning("Failed to fetch status for %s: %s", job_id, exc)
-            return None
+            return None, False
 
     # ------------------------------------------------------------------
     # Shared helpers
@@ -561,10 +662,20 @@ class WorkerAgent:
         try:
             if job.get("device_requests"):
                 return job["device_requests"]
-            return [DeviceRequest(count=-1, capabilities=[["gpu"]])]
+            if self._default_device_requests is None:
+                from docker.types import DeviceRequest  # deferred: only GPU-enabled workers need docker.types
+
+                self._default_device_requests = [DeviceRequest(count=-1, capabilities=[["gpu"]])]
+            return self._default_device_requests
         except Exception:  # pragma: no cover - defensive
             return None
 
+    def _disable_gpu_requests(self, reason: str) -> None:
+        if not self._gpu_request_enabled:
+            return
+        self._gpu_request_enabled = False
+        _LOGGER.warning("Disabling GPU requests for this worker; the host cannot provide GPUs: %s", reason)
+
     def _build_volumes(self, vols: Optional[Any]) -> Dict[str, Dict[str, str]]:
         if isinstance(vols, list):
             out: Dict[str, Dict[str, str]] = {}
@@ -579,7 +690,7 @@ class WorkerAgent:
                     continue
             if out:
                 return out
-        return {self.shared_dir: {"bind": "/data", "mode": "rw"}}
+        return self._default_volumes
 
     def _reset_session(self) -> None:
         if self._external_session:
@@ -589,19 +700,37 @@ class WorkerAgent:
                 self._session.close()
             except Exception:
                 pass
-            self._session = requests.Session()
+            self._session = _build_http_session()
+
+    def _reset_next_job_session(self) -> None:
+        if self._external_session:
+            return
+        try:
+            self._next_job_session.close()
+        except Exception:
+            pass
+        self._next_job_session = _build_http_session()
 
-    def _handle_request_exception(self, context: str, exc: requests.RequestException, warning: bool = False) -> None:
+    def _handle_request_exception(
+        self,
+        context: str,
+        exc: requests.RequestException,
+        warning: bool = False,
+        reset: Optional[Callable[[], None]] = None,
+    ) -> None:
         is_repeat = self._last_request_failure == context
         log_func = _LOGGER.warning if warning and not is_repeat else (_LOGGER.debug if is_repeat else _LOGGER.error)
         log_func("Request to %s failed: %s", context, exc)
-        self._reset_session()
-        _LOGGER.debug("HTTP session reset after %s failure", context)
+        if not isinstance(exc, requests.HTTPError):
+            # Error responses arrive over a healthy connection; only transport
+            # failures drop the pool so the next connect re-resolves the host.
+            (reset or self._reset_session)()
+            _LOGGER.debug("HTTP session reset after %s failure", context)
         self._last_request_failure = context
 
     def _build_container_name(self, job_id: str, job_name: str) -> str:
-        safe_job = "".join(ch if ch.isalnum() or ch in "-._" else "_" for ch in job_name)[:40]
-        return f"job_{self.worker_id}_{safe_job}_{job_id[:8]}"
+        safe_job = _CONTAINER_NAME_UNSAFE.sub("_", job_name[:40])
+        return f"{self._container_name_prefix}{safe_job}_{job_id[:8]}"
 
     @staticmethod
     def _chmod_best_effort(path: Path, mode: int) -> None:
@@ -611,16 +740,20 @@ class WorkerAgent:
             return
 
     def _prepare_log_file(self, job_id: str) -> Path:
-        jobs_dir = Path(self.shared_dir) / "jobs"
-        job_dir = jobs_dir / job_id
+        job_dir = self._jobs_root / job_id
         logs_dir = job_dir / "logs"
-        logs_dir.mkdir(parents=True, exist_ok=True)
         log_path = logs_dir / f"{job_id}.log"
+        if log_path.is_file():
+            # Already prepared (executors may call this several times per job).
+            return log_path
+        logs_dir.mkdir(parents=True, exist_ok=True)
         log_path.touch(exist_ok=True)
 
         # Keep files/directories accessible from backend/UI processes that may run
         # under a different uid than this worker container.
-        self._chmod_best_effort(jobs_dir, 0o777)
+        if not self._jobs_root_prepared:
+            self._chmod_best_effort(self._jobs_root, 0o777)
+            self._jobs_root_prepared = True
         self._chmod_best_effort(job_dir, 0o777)
         self._chmod_best_effort(logs_dir, 0o777)
         self._chmod_best_effort(log_path, 0o666)
@@ -633,13 +766,80 @@ class WorkerAgent:
             _LOGGER.info("Exit-after-job requested while idle; stopping worker immediately")
             self.stop()
 
+    def _status_sender_running(self) -> bool:
+        thread = self._status_sender_thread
+        return thread is not None and thread.is_alive()
+
+    def _start_status_sender(self) -> None:
+        t = threading.Thread(target=self._status_sender_loop, name="status-sender", daemon=True)
+        t.start()
+        self._status_sender_thread = t
+
+    def _stop_status_sender(self) -> None:
+        thread = self._status_sender_thread
+        if thread is None:
+            return
+        self._status_queue.put(None)
+        thread.join(timeout=_STATUS_SENDER_SHUTDOWN_TIMEOUT_SECONDS)
+        if thread.is_alive():
+            _LOGGER.warning("Status sender did not drain within %.0fs", _STATUS_SENDER_SHUTDOWN_TIMEOUT_SECONDS)
+
+    def _status_sender_loop(self) -> None:
+        while True:
+            batch = [self._status_queue.get()]
+            while True:
+                try:
+                    batch.append(self._status_queue.get_nowait())
+                except queue.Empty:
+                    break
+            payloads = [item for item in batch if item is not None]
+            for payload in self._coalesce_status_payloads(payloads):
+                try:
+                    self._deliver_status(payload)
+                except Exception:  # pragma: no cover - defensive
+                    _LOGGER.exception("Failed to deliver job status %s", payload)
+            for _ in batch:
+                self._status_queue.task_done()
+            if len(payloads) != len(batch):
+                return
+
+    @staticmethod
+    def _coalesce_status_payloads(payloads: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        # Drop a non-terminal update only when the job's next queued update is an
+        # identical payload (e.g. stacked "running" keep-alives). Updates that differ
+        # in any field (container details, executor stage ``details``) are all sent.
+        kept: list[Dict[str, Any]] = []
+        next_payload: dict[Any, Dict[str, Any]] = {}
+        for payload in reversed(payloads):
+            job_id = payload.get("job_id")
+            if payload.get("status") not in _TERMINAL_JOB_STATUSES and next_payload.get(job_id) == payload:
+                continue
+            next_payload[job_id] = payload
+            kept.append(payload)
+        kept.reverse()
+        return kept
+
+    def _heartbeat_loop_running(self) -> bool:
+        thread = self._heartbeat_thread
+        return thread is not None and thread.is_alive()
+
     def _start_heartbeat_loop(self) -> None:
         if self.heartbeat_interval <= 0:
             return
 
         def _loop() -> None:
-            while not self._stop_event.wait(self.heartbeat_interval):
-                self._send_heartbeat()
+            self._send_heartbeat(force=True)
+            while True:
+                self._heartbeat_wakeup.wait(self.heartbeat_interval)
+                self._heartbeat_wakeup.clear()
+                forced = self._heartbeat_requested.is_set()
+                self._heartbeat_requested.clear()
+                # A heartbeat requested right before stop() (e.g. after the last job
+                # with exit-after-job) is still sent before the loop exits.
+                if forced or not self._stop_event.is_set():
+                    self._send_heartbeat(force=forced)
+                if self._stop_event.is_set():
+                    break
 
         t = threading.Thread(target=_loop, name="heartbeat-loop", daemon=True)
         t.start()
@@ -664,6 +864,12 @@ def build_arg_parser() -> argparse.ArgumentParser:
         type=float,
         default=float(os.environ.get("STATUS_POLL_INTERVAL", "10")),
     )
+    parser.add_argument(
+        "--next-job-wait",
+        type=float,
+        default=float(os.environ.get("WORKER_NEXT_JOB_WAIT", "0")),
+        help="Seconds the backend may hold /api/agent/next-job open (long-poll); 0 disables",
+    )
     parser.add_argument(
         "--exit-after-job",
         action="store_true",
@@ -675,4 +881,4 @@ def build_arg_parser() -> argparse.ArgumentParser:
 
 
 def configure_logging(level: str) -> None:
-    logging.basicConfig(level=getattr(logging, level.upper(), logging.INFO), format="%(asctime)s %(levelname)s %(message)s")
+    logging.basicConfig(level=_LOG_LEVELS.get(level.upper(), logging.INFO), format="%(asctime)s %(levelname)s %(message)s")
@@ -23,12 +23,13 @@ def main() -> None:
         poll_interval=args.poll_interval,
         heartbeat_interval=args.heartbeat_interval,
         status_poll_interval=args.status_poll_interval,
+        next_job_wait=args.next_job_wait,
         exit_after_job=args.exit_after_job,
     )
 
     logger = logging.getLogger(__name__)
 
-    def _handle_exit_after_job(signum, frame):  # pragma: no cover - requires signal
+    def _handle_exit_after_job(signum, frame):
         logger.info("Received %s; will terminate after current job", signal.Signals(signum).name)
         agent.request_exit_after_current_job()
 
@@ -17,9 +17,15 @@ class WorkerRuntime(Protocol):
     def _fetch_status(self, job_id: str) -> str | None:
         ...
 
+    def _fetch_status_conditional(self, job_id: str) -> tuple[str | None, bool]:
+        ...
+
     def _send_heartbeat(self, force: bool = False) -> None:
         ...
 
+    def _request_heartbeat(self) -> None:
+        ...
+
     def _build_command(self, job_id: str, config_path: str) -> str:
         ...
 
@@ -32,6 +38,9 @@ class WorkerRuntime(Protocol):
     def _build_device_requests(self, job: Dict[str, Any] | None = None) -> list | None:
         ...
 
+    def _disable_gpu_requests(self, reason: str) -> None:
+        ...
+
     def _prepare_log_file(self, job_id: str):
         ...
 
@@ -1713,4 +1713,4 @@ class DeucalionExecutor(BaseExecutor):
             )
         finally:
             self.runtime._unregister_active_job(job_id)
-            self.runtime._send_heartbeat(force=True)
+            self.runtime._request_heartbeat()
@@ -1,15 +1,14 @@
 from __future__ import annotations
 
+import importlib.util
 import logging
 import os
 import threading
 import time
-from typing import Any, Callable, Dict, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
 
-try:  # docker is optional at import time for tooling
+if TYPE_CHECKING:  # docker is imported on first client use to keep worker start-up cheap
     import docker
-except ImportError:  # pragma: no cover - tests inject a fake client
-    docker = None  # type: ignore
 
 from .base import BaseExecutor, WorkerRuntime
 
@@ -17,6 +16,23 @@ _LOGGER = logging.getLogger(__name__)
 _RUNNING_CONTAINER_STATES = {"running", "restarting"}
 _BACKEND_ACTIVE_JOB_STATUSES = {"launching", "dispatched", "running", "stop_requested"}
 _BACKEND_TERMINAL_OR_QUEUED_STATUSES = {"queued", "finished", "failed", "stopped", "canceled"}
+_BACKEND_STOP_STATUSES = {"stop_requested", "canceled", "queued", "failed", "finished", "stopped"}
+_STATUS_POLL_MAX_BACKOFF_SECONDS = 60.0
+_LOG_BUFFER_BYTES = 1 << 20
+_LOG_FLUSH_BYTES = 256 * 1024
+_LOG_FLUSH_INTERVAL_SECONDS = 1.0
+# Daemon errors meaning the host cannot serve GPU requests at all (not transient, unlike GPU OOM).
+_GPU_UNAVAILABLE_ERROR_MARKERS = (
+    "could not select device driver",
+    "unknown or invalid runtime name: nvidia",
+    "nvml error: driver not loaded",
+)
+
+
+def _default_docker_client() -> "docker.DockerClient":
+    import docker
+
+    return docker.DockerClient(base_url="unix://var/run/docker.sock")
 
 
 class DockerExecutor(BaseExecutor):
@@ -30,11 +46,12 @@ class DockerExecutor(BaseExecutor):
         if self.pull_policy not in {"always", "if-not-present", "never"}:
             self.pull_policy = "always"
         if docker_client_factory is None:
-            if docker is None:
+            if importlib.util.find_spec("docker") is None:
                 raise RuntimeError("docker package is not available")
-            docker_client_factory = lambda: docker.DockerClient(base_url="unix://var/run/docker.sock")
+            docker_client_factory = _default_docker_client
         self._docker_client_factory = docker_client_factory
         self._docker_client_instance: Optional["docker.DockerClient"] = None
+        self._base_labels = {"opeva.worker_id": self.runtime.worker_id}
         self._cleanup_enabled = os.environ.get("WORKER_DOCKER_ORPHAN_CLEANUP", "1").strip().lower() in {
             "1",
             "true",
@@ -46,6 +63,19 @@ class DockerExecutor(BaseExecutor):
             float(os.environ.get("WORKER_DOCKER_ORPHAN_CLEANUP_INTERVAL_SECONDS", "30")),
         )
         self._last_cleanup_ts = 0.0
+        # One watcher thread polls backend status for every running container.
+        self._watch_lock = threading.Lock()
+        self._watched_jobs: Dict[str, Dict[str, Any]] = {}
+        self._watcher_thread: Optional[threading.Thread] = None
+        self._watcher_stop = threading.Event()
+        self._watcher_wakeup = threading.Event()
+        # One flusher thread pushes buffered job output to disk while streams are idle.
+        self._log_lock = threading.Lock()
+        self._open_logs: Dict[str, Dict[str, Any]] = {}
+        self._log_flusher_thread: Optional[threading.Thread] = None
+        self._log_flusher_stop = threading.Event()
+        # Time source for watcher deadlines and log flush ages (tests inject a fake one).
+        self._clock: Callable[[], float] = time.monotonic
 
     def _get_docker_client(self) -> "docker.DockerClient":
         if self._docker_client_instance is None:
@@ -56,6 +86,10 @@ class DockerExecutor(BaseExecutor):
         message = str(exc).lower()
         return "conflict" in message and "already in use" in message
 
+    def _is_gpu_unavailable_error(self, exc: Exception) -> bool:
+        message = str(exc).lower()
+        return any(marker in message for marker in _GPU_UNAVAILABLE_ERROR_MARKERS)
+
     def _remove_stale_container(self, client: "docker.DockerClient", container_name: str) -> bool:
         try:
             stale = client.containers.get(container_name)
@@ -200,6 +234,139 @@ class DockerExecutor(BaseExecutor):
                         exc,
                     )
 
+    def _watch_job(self, job_id: str, container: Any, container_id: Any, container_name: Any) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "container": container,
+            "container_id": container_id,
+            "container_name": container_name,
+            "status": None,
+            "active": True,
+            "lock": threading.Lock(),
+            "poll_interval": self.runtime.status_poll_interval,
+            "next_poll_at": self._clock() + self.runtime.status_poll_interval,
+        }
+        with self._watch_lock:
+            self._watched_jobs[job_id] = entry
+            if self._watcher_thread is None or not self._watcher_thread.is_alive():
+                self._watcher_thread = threading.Thread(
+                    target=self._status_watch_loop,
+                    name="docker-status-watcher",
+                    daemon=True,
+                )
+                self._watcher_thread.start()
+        self._watcher_wakeup.set()
+        return entry
+
+    def _unwatch_job(self, job_id: str) -> None:
+        with self._watch_lock:
+            entry = self._watched_jobs.pop(job_id, None)
+        if entry is None:
+            return
+        # Waits for an in-flight poll so no "running" update lands after the final status.
+        with entry["lock"]:
+            entry["active"] = False
+
+    def _status_watch_loop(self) -> None:
+        while not self._watcher_stop.is_set():
+            with self._watch_lock:
+                if not self._watched_jobs:
+                    self._watcher_thread = None
+                    return
+                entries = list(self._watched_jobs.items())
+            due_times = [entry["next_poll_at"] for _, entry in entries if entry["active"]]
+            if due_times:
+                remaining = min(due_times) - self._clock()
+            else:
+                remaining = self.runtime.status_poll_interval
+            if remaining > 0:
+                # Sleep until the earliest deadline; new jobs and close() wake us early.
+                self._watcher_wakeup.wait(remaining)
+                self._watcher_wakeup.clear()
+                continue
+            for job_id, entry in entries:
+                try:
+                    self._poll_watched_job(job_id, entry)
+                except Exception:  # pragma: no cover - keep watching the other jobs
+                    _LOGGER.exception("Status watcher failed to poll job %s", job_id)
+
+    def _schedule_next_poll(self, entry: Dict[str, Any], not_modified: bool) -> None:
+        # Back off while the backend reports the status unchanged (304).
+        base_interval = self.runtime.status_poll_interval
+        if not_modified:
+            entry["poll_interval"] = max(
+                base_interval,
+                min(entry["poll_interval"] * 2, _STATUS_POLL_MAX_BACKOFF_SECONDS),
+            )
+        else:
+            entry["poll_interval"] = base_interval
+        # Keep a steady cadence from the previous deadline; skip ticks a slow fetch overran.
+        next_poll_at = entry["next_poll_at"] + entry["poll_interval"]
+        now = self._clock()
+        entry["next_poll_at"] = next_poll_at if next_poll_at > now else now + entry["poll_interval"]
+
+    def _poll_watched_job(self, job_id: str, entry: Dict[str, Any]) -> None:
+        with entry["lock"]:
+            if not entry["active"] or self._clock() < entry["next_poll_at"]:
+                return
+            status, not_modified = None, False
+            try:
+                status, not_modified = self.runtime._fetch_status_conditional(job_id)
+            finally:
+                # Reschedule even when the fetch raises, so a failing job never busy-polls.
+                self._schedule_next_poll(entry, not_modified)
+            if status in _BACKEND_STOP_STATUSES:
+                entry["status"] = status
+                entry["active"] = False
+                container = entry["container"]
+                try:
+                    if hasattr(container, "stop"):
+                        container.stop()
+                except Exception:  # pragma: no cover
+                    pass
+                return
+            self.runtime._post_status(
+                job_id,
+                "running",
+                container_id=entry["container_id"],
+                container_name=entry["container_name"],
+            )
+
+    def _open_job_log(self, job_id: str, log_file: Any) -> None:
+        with self._log_lock:
+            self._open_logs[job_id] = {"file": log_file, "flushed_at": self._clock()}
+            if self._log_flusher_thread is None or not self._log_flusher_thread.is_alive():
+                self._log_flusher_thread = threading.Thread(
+                    target=self._log_flush_loop,
+                    name="docker-log-flusher",
+                    daemon=True,
+                )
+                self._log_flusher_thread.start()
+
+    def _close_job_log(self, job_id: str) -> None:
+        # Holding the lock guarantees the flusher is not touching the file when the caller closes it.
+        with self._log_lock:
+            self._open_logs.pop(job_id, None)
+
+    def _log_flush_loop(self) -> None:
+        while not self._log_flusher_stop.wait(_LOG_FLUSH_INTERVAL_SECONDS):
+            with self._log_lock:
+                if not self._open_logs:
+                    self._log_flusher_thread = None
+                    return
+            self._flush_stale_logs()
+
+    def _flush_stale_logs(self) -> None:
+        now = self._clock()
+        with self._log_lock:
+            for job_id, entry in self._open_logs.items():
+                if now - entry["flushed_at"] < _LOG_FLUSH_INTERVAL_SECONDS:
+                    continue
+                try:
+                    entry["file"].flush()
+                except (OSError, ValueError):  # pragma: no cover - keep flushing other jobs
+                    _LOGGER.warning("Failed to flush log file for job %s", job_id)
+                entry["flushed_at"] = now
+
     def on_startup(self) -> None:
         client = self._get_docker_client()
         self._cleanup_orphan_job_containers(client, force=True)
@@ -210,9 +377,7 @@ class DockerExecutor(BaseExecutor):
         job_name = job.get("job_name", job_id)
 
         container = None
-        monitor_thread: Optional[threading.Thread] = None
-        monitor_state = {"status": None}
-        monitor_stop = threading.Event()
+        watch_entry: Optional[Dict[str, Any]] = None
         try:
             self.runtime._register_active_job(job_id, str(job_name))
             self.runtime._update_active_job(job_id, phase="startup")
@@ -225,10 +390,7 @@ class DockerExecutor(BaseExecutor):
             except TypeError:
                 # Maintain compatibility with tests that monkeypatch without params
                 device_requests = self.runtime._build_device_requests()
-            labels = {
-                "opeva.worker_id": self.runtime.worker_id,
-                "opeva.job_id": job_id,
-            }
+            labels = {**self._base_labels, "opeva.job_id": job_id}
             _LOGGER.info("Starting container %s for job %s", container_name, job_id)
             client = self._get_docker_client()
             self._cleanup_orphan_job_containers(client)
@@ -249,6 +411,8 @@ class DockerExecutor(BaseExecutor):
             except Exception as exc:
                 if device_requests:
                     _LOGGER.info("GPU request failed (%s); retrying without GPU", exc)
+                    if self._is_gpu_unavailable_error(exc):
+                        self.runtime._disable_gpu_requests(str(exc))
                     self._remove_stale_container(client, container_name)
                     run_kwargs.pop("device_requests", None)
                     try:
@@ -278,50 +442,33 @@ class DockerExecutor(BaseExecutor):
             )
 
             if self.runtime.status_poll_interval > 0:
-                backend_stop_states = {
-                    "stop_requested",
-                    "canceled",
-                    "queued",
-                    "failed",
-                    "finished",
-                    "stopped",
-                }
-
-                def _monitor() -> None:
-                    while not monitor_stop.wait(self.runtime.status_poll_interval):
-                        status = self.runtime._fetch_status(job_id)
-                        if status in backend_stop_states:
-                            monitor_state["status"] = status
-                            try:
-                                if hasattr(container, "stop"):
-                                    container.stop()
-                            except Exception:  # pragma: no cover
-                                pass
-                            break
-                        self.runtime._post_status(
-                            job_id,
-                            "running",
-                            container_id=container_id,
-                            container_name=container_name,
-                        )
-
-                monitor_thread = threading.Thread(target=_monitor, name=f"monitor-{job_id}")
-                monitor_thread.daemon = True
-                monitor_thread.start()
+                watch_entry = self._watch_job(job_id, container, container_id, container_name)
 
             log_path = self.runtime._prepare_log_file(job_id)
             _LOGGER.info("Streaming logs for job %s into %s", job_id, log_path)
-            with open(log_path, "a", encoding="utf-8") as log_file:
-                for chunk in container.logs(stream=True, follow=True):
-                    text = chunk.decode("utf-8", errors="replace") if isinstance(chunk, bytes) else str(chunk)
-                    log_file.write(text)
-                    log_file.flush()
+            with open(log_path, "ab", buffering=_LOG_BUFFER_BYTES) as log_file:
+                # Flush by size here rather than per chunk (docker often streams one line
+                # at a time); the flusher thread covers output from quiet jobs.
+                self._open_job_log(job_id, log_file)
+                try:
+                    unflushed = 0
+                    for chunk in container.logs(stream=True, follow=True):
+                        # Container output is appended byte-for-byte; no decode/encode round trip.
+                        data = chunk if isinstance(chunk, (bytes, bytearray)) else str(chunk).encode("utf-8", "replace")
+                        log_file.write(data)
+                        unflushed += len(data)
+                        if unflushed >= _LOG_FLUSH_BYTES:
+                            log_file.flush()
+                            unflushed = 0
+                finally:
+                    self._close_job_log(job_id)
 
             result = container.wait()
+            self._unwatch_job(job_id)
             exit_code = None
             if isinstance(result, dict):
                 exit_code = result.get("StatusCode")
-            final_status = monitor_state.get("status")
+            final_status = watch_entry["status"] if watch_entry is not None else None
             if final_status in {"stop_requested", "canceled"}:
                 reported_status = "stopped" if final_status == "stop_requested" else "canceled"
                 self.runtime._post_status(job_id, reported_status, exit_code=exit_code)
@@ -347,18 +494,22 @@ class DockerExecutor(BaseExecutor):
             self._append_startup_error_log(job_id, exc)
             self.runtime._post_status(job_id, "failed", error=str(exc))
         finally:
-            monitor_stop.set()
-            if monitor_thread is not None:
-                monitor_thread.join(timeout=1)
+            self._unwatch_job(job_id)
             if container is not None:
                 try:
                     container.remove(force=True)
                 except Exception:  # pragma: no cover
                     pass
             self.runtime._unregister_active_job(job_id)
-            self.runtime._send_heartbeat(force=True)
+            self.runtime._request_heartbeat()
 
     def close(self) -> None:
+        self._log_flusher_stop.set()
+        self._watcher_stop.set()
+        self._watcher_wakeup.set()
+        watcher = self._watcher_thread
+        if watcher is not None:
+            watcher.join(timeout=1)
         client = self._docker_client_instance
         if client is not None:
             try: